@@ -5,10 +5,14 @@ from email.mime.text import MIMEText
 from email.utils import formataddr, parseaddr
 from typing import Any
 
+from jinja2 import BaseLoader, Environment
 from loguru import logger
 
 from paper import ArxivPaper
 
+# A paper together with its score for the section it is listed in.
+ScoredPaper = tuple[ArxivPaper, float]
+
 framework = """
 <!DOCTYPE HTML>
 <html>
@@ -43,7 +47,7 @@ framework = """
 <body>
 
 <div>
-    __CONTENT__
+    {{ content | safe }}
 </div>
 
 <br><br>
@@ -56,45 +60,19 @@ To unsubscribe, remove your email in your Github Action setting.
 """
 
 
-def get_empty_html():
-    block_template = """
-  <table border="0" cellpadding="0" cellspacing="0" width="100%" style="font-family: Arial, sans-serif; border: 1px solid #ddd; border-radius: 8px; padding: 16px; background-color: #f9f9f9;">
-  <tr>
-    <td style="font-size: 20px; font-weight: bold; color: #333;">
-        No Papers Today. Take a Rest!
-    </td>
-  </tr>
-  </table>
-  """
-    return block_template
+def _section_id(section_name: str) -> str:
+    return section_name.lower().replace(" ", "-").replace("_", "-")
 
 
-def get_stats_html(papers: list[ArxivPaper], debug_info: dict[str, Any]):
-    stats_parts = []
-    stats_parts.append("<div style='font-family: Arial, sans-serif; margin-bottom: 24px;'>")
-    stats_parts.append("<h3>Statistics:</h3>")
-    stats_parts.append("<ul>")
-    stats_parts.append(f"<li>Min Score: {debug_info['min_score']:.2f}</li>")
-    stats_parts.append(f"<li>Max Score: {debug_info['max_score']:.2f}</li>")
-    stats_parts.append(f"<li>Threshold: {debug_info['threshold']}</li>")
-    stats_parts.append(f"<li>Matching Papers: {len(papers)} / {debug_info['papers_considered']}</li>")
-    stats_parts.append("</ul>")
-    stats_parts.append("</div>")
-    return "".join(stats_parts)
+# Templates are compiled once at import and reused for every paper / section.
+_ENV = Environment(loader=BaseLoader(), autoescape=True, trim_blocks=True, lstrip_blocks=True)
+_ENV.filters["section_id"] = _section_id
 
+_PAGE_TMPL = _ENV.from_string(framework)
 
-def get_toc_html(
-    papers_by_section: dict[str | None, list[ArxivPaper]],
-    debug_info: dict[str | None, dict],
-    global_debug_info: dict[str, Any],
-):
-    """Generate Table of Contents with debug information."""
-    toc_parts = []
-    toc_parts.append("<div style='font-family: Arial, sans-serif; margin-bottom: 24px;'>")
-    toc_parts.append("<h3>Table of Contents:</h3>")
-
-    # Create table structure
-    toc_parts.append("""
+_TOC_TMPL = _ENV.from_string("""\
+<div style='font-family: Arial, sans-serif; margin-bottom: 24px;'>
+<h3>Table of Contents:</h3>
     <table border="1" cellpadding="8" cellspacing="0" style="border-collapse: collapse; width: 100%; font-size: 14px;">
         <thead>
             <tr style="background-color: #f5f5f5;">
@@ -106,94 +84,120 @@ def get_toc_html(
             </tr>
         </thead>
         <tbody>
-    """)
-
-    threshold = global_debug_info["threshold"]
-    papers_considered = global_debug_info["papers_considered"]
-
-    for section_name in sorted(papers_by_section.keys()):
-        papers = papers_by_section.get(section_name, [])
-        matching_papers = len(papers)
-        section_debug = debug_info.get(section_name, {}) if debug_info else {}
-
-        # Get debug info values
-        min_score = section_debug["min_score"]
-        max_score = section_debug["max_score"]
-
-        # Create table row
-        toc_parts.append("<tr>")
-
-        # Tag column - with link if there are matching papers
-        if matching_papers == 0:
-            toc_parts.append(f'<td style="padding: 8px;">{section_name}</td>')
-        else:
-            section_id = section_name.lower().replace(" ", "-").replace("_", "-")
-            toc_parts.append(f'<td style="padding: 8px;"><a href="#{section_id}">{section_name}</a></td>')
-
-        # Other columns
-        toc_parts.append(f'<td style="text-align: center; padding: 8px;">{min_score:.2f}</td>')
-        toc_parts.append(f'<td style="text-align: center; padding: 8px;">{max_score:.2f}</td>')
-        toc_parts.append(f'<td style="text-align: center; padding: 8px;">{threshold}</td>')
-        toc_parts.append(f'<td style="text-align: center; padding: 8px;">{matching_papers} / {papers_considered}</td>')
-
-        toc_parts.append("</tr>")
-
-    toc_parts.append("</tbody>")
-    toc_parts.append("</table>")
-    toc_parts.append("</div>")
-
-    return "".join(toc_parts)
-
-
-def get_section_header_html(section_name: str):
-    section_id = section_name.lower().replace(" ", "-").replace("_", "-")
-    return f'<div class="section-header" id="{section_id}">{section_name}</div>'
+{% for section_name, papers in sections %}
+{% set section_debug = debug_info[section_name] %}
+<tr>
+{% if papers %}
+<td style="padding: 8px;"><a href="#{{ section_name | section_id }}">{{ section_name }}</a></td>
+{% else %}
+<td style="padding: 8px;">{{ section_name }}</td>
+{% endif %}
+<td style="text-align: center; padding: 8px;">{{ "%.2f" | format(section_debug["min_score"]) }}</td>
+<td style="text-align: center; padding: 8px;">{{ "%.2f" | format(section_debug["max_score"]) }}</td>
+<td style="text-align: center; padding: 8px;">{{ threshold }}</td>
+<td style="text-align: center; padding: 8px;">{{ papers | length }} / {{ papers_considered }}</td>
+</tr>
+{% endfor %}
+</tbody>
+</table>
+</div>
+""")
 
+_SECTION_HEADER_TMPL = _ENV.from_string(
+    '<div class="section-header" id="{{ section_name | section_id }}">{{ section_name }}</div>'
+)
 
-def get_block_html(
-    title: str,
-    authors: str,
-    score: float,
-    arxiv_id: str,
-    abstract: str,
-    pdf_url: str,
-):
-    block_template = """
+_BLOCK_TMPL = _ENV.from_string("""
     <table border="0" cellpadding="0" cellspacing="0" width="100%" style="font-family: Arial, sans-serif; border: 1px solid #ddd; border-radius: 8px; padding: 16px; background-color: #f9f9f9;">
     <tr>
         <td style="font-size: 20px; font-weight: bold; color: #333;">
-            {title}
+            {{ title }}
         </td>
     </tr>
     <tr>
         <td style="font-size: 14px; color: #666; padding: 8px 0;">
-            {authors}
+            {{ authors }}
         </td>
     </tr>
     <tr>
         <td style="font-size: 14px; color: #333; padding: 8px 0;">
-            <strong>Score:</strong> {score:.2f}
+            <strong>Score:</strong> {{ "%.2f" | format(score) }}
         </td>
     </tr>
     <tr>
         <td style="font-size: 14px; color: #333; padding: 8px 0;">
-            <strong>arXiv ID:</strong> {arxiv_id}
+            <strong>arXiv ID:</strong> {{ arxiv_id }}
         </td>
     </tr>
     <tr>
         <td style="font-size: 14px; color: #333; padding: 8px 0;">
-            <strong>Abstract:</strong> {abstract}
+            <strong>Abstract:</strong> {{ abstract }}
         </td>
     </tr>
 
     <tr>
         <td style="padding: 8px 0;">
-            <a href="{pdf_url}" style="display: inline-block; text-decoration: none; font-size: 14px; font-weight: bold; color: #fff; background-color: #d9534f; padding: 8px 16px; border-radius: 4px;">PDF</a>
+            <a href="{{ pdf_url }}" style="display: inline-block; text-decoration: none; font-size: 14px; font-weight: bold; color: #fff; background-color: #d9534f; padding: 8px 16px; border-radius: 4px;">PDF</a>
         </td>
     </tr>
 </table>
-"""
-    return block_template.format(
+""")
+
+
+def get_empty_html():
+    block_template = """
+  <table border="0" cellpadding="0" cellspacing="0" width="100%" style="font-family: Arial, sans-serif; border: 1px solid #ddd; border-radius: 8px; padding: 16px; background-color: #f9f9f9;">
+  <tr>
+    <td style="font-size: 20px; font-weight: bold; color: #333;">
+        No Papers Today. Take a Rest!
+    </td>
+  </tr>
+  </table>
+  """
+    return block_template
+
+
+def get_stats_html(papers: list[ScoredPaper], debug_info: dict[str, Any]):
+    return (
+        "<div style='font-family: Arial, sans-serif; margin-bottom: 24px;'>"
+        "<h3>Statistics:</h3>"
+        "<ul>"
+        f"<li>Min Score: {debug_info['min_score']:.2f}</li>"
+        f"<li>Max Score: {debug_info['max_score']:.2f}</li>"
+        f"<li>Threshold: {debug_info['threshold']}</li>"
+        f"<li>Matching Papers: {len(papers)} / {debug_info['papers_considered']}</li>"
+        "</ul>"
+        "</div>"
+    )
+
+
+def get_toc_html(
+    sections: list[tuple[str, list[ScoredPaper]]],
+    debug_info: dict[str | None, dict],
+    global_debug_info: dict[str, Any],
+):
+    """Generate Table of Contents with debug information, one row per (section name, papers) item."""
+    return _TOC_TMPL.render(
+        sections=sections,
+        debug_info=debug_info,
+        threshold=global_debug_info["threshold"],
+        papers_considered=global_debug_info["papers_considered"],
+    )
+
+
+def get_section_header_html(section_name: str):
+    return _SECTION_HEADER_TMPL.render(section_name=section_name)
+
+
+def get_block_html(
+    title: str,
+    authors: str,
+    score: float,
+    arxiv_id: str,
+    abstract: str,
+    pdf_url: str,
+):
+    return _BLOCK_TMPL.render(
         title=title,
         authors=authors,
         score=score,
@@ -204,46 +208,86 @@ def get_block_html(
 
 
 def render_email(
-    papers_by_tag: dict[str | None, list[ArxivPaper]],
+    papers_by_tag: dict[str | None, list[ScoredPaper]],
     debug_info: dict[str | None, dict],
     global_debug_info: dict[str, Any],
 ):
-    all_parts = []
-    total_papers = sum(len(papers) for papers in papers_by_tag.values())
+    # Sections are listed in the same (sorted) order in the TOC and in the body.
+    sections = sorted(papers_by_tag.items(), key=lambda item: item[0] or "")
+    total_papers = sum(len(papers) for _, papers in sections)
     use_sections = global_debug_info["use_sections"]
 
-    if total_papers == 0:
-        if debug_info:
-            empty_content = get_stats_html(papers_by_tag[None], debug_info[None] | global_debug_info) + get_empty_html()
-            return framework.replace("__CONTENT__", empty_content)
-        return framework.replace("__CONTENT__", get_empty_html())
-
     if use_sections:
-        all_parts.append(get_toc_html(papers_by_tag, debug_info, global_debug_info))
+        summary_html = get_toc_html(sections, debug_info, global_debug_info)
     else:
-        all_parts.append(get_stats_html(papers_by_tag[None], debug_info[None] | global_debug_info))
+        summary_html = get_stats_html(papers_by_tag[None], debug_info[None] | global_debug_info)
 
-    for section_name, papers in papers_by_tag.items():
-        if not papers:
-            continue
+    if total_papers == 0:
+        return _PAGE_TMPL.render(content=summary_html + get_empty_html())
+
+    def iter_parts():
+        yield summary_html
+
+        for section_name, papers in sections:
+            if not papers:
+                continue
+
+            # Add section header only if using sections
+            if use_sections:
+                yield get_section_header_html(section_name)
+
+            for p, score in papers:
+                yield get_block_html(p.title, p.authors_short, score, p.arxiv_id, p.summary, p.pdf_url)
+
+    content = "<br>" + "</br><br>".join(iter_parts()) + "</br>"
+    return _PAGE_TMPL.render(content=content)
 
-        section_parts = []
 
-        # Add section header only if using sections
-        if use_sections:
-            section_parts.append(get_section_header_html(section_name))
+class SMTPSession:
+    """SMTP connection that stays logged in across messages.
 
-        for p in papers:
-            authors = [a.name for a in p.authors[:5]]
-            authors = ", ".join(authors)
-            if len(p.authors) > 5:
-                authors += ", ..."
-            section_parts.append(get_block_html(p.title, authors, p.score, p.arxiv_id, p.summary, p.pdf_url))
+    Use as a context manager and call `send` for each message, so that TCP, TLS and AUTH are set up once.
+    """
 
-        all_parts.extend(section_parts)
+    def __init__(self, sender: str, password: str, smtp_server: str, smtp_port: int):
+        self.sender = sender
+        self.password = password
+        self.smtp_server = smtp_server
+        self.smtp_port = smtp_port
+        self._server: smtplib.SMTP | None = None
 
-    content = "<br>" + "</br><br>".join(all_parts) + "</br>"
-    return framework.replace("__CONTENT__", content)
+    def _connect(self):
+        try:
+            server = smtplib.SMTP(self.smtp_server, self.smtp_port)
+            server.starttls()
+        except Exception as e:
+            logger.warning(f"Failed to use TLS. {e}")
+            logger.warning("Try to use SSL.")
+            server = smtplib.SMTP_SSL(self.smtp_server, self.smtp_port)
+
+        server.login(self.sender, self.password)
+        self._server = server
+
+    def __enter__(self):
+        self._connect()
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self._server.quit()
+        except smtplib.SMTPServerDisconnected:
+            pass
+        self._server = None
+
+    def send(self, receiver: str, msg: MIMEText):
+        try:
+            self._server.send_message(msg, self.sender, [receiver])
+        except smtplib.SMTPServerDisconnected:
+            logger.warning("SMTP server disconnected. Reconnecting once.")
+            # Release the dead socket before opening a new one.
+            self._server.close()
+            self._connect()
+            self._server.send_message(msg, self.sender, [receiver])
 
 
 def send_email(
@@ -253,7 +297,10 @@ def send_email(
     smtp_server: str,
     smtp_port: int,
     html: str,
+    session: SMTPSession | None = None,
 ):
+    """Send the email, reusing `session` if given, otherwise through a connection opened for this email only."""
+
     def _format_addr(s):
         name, addr = parseaddr(s)
         return formataddr((Header(name, "utf-8").encode(), addr))
@@ -264,14 +311,8 @@ def send_email(
     today = datetime.datetime.now().strftime("%Y/%m/%d")
     msg["Subject"] = Header(f"Daily arXiv {today}", "utf-8").encode()
 
-    try:
-        server = smtplib.SMTP(smtp_server, smtp_port)
-        server.starttls()
-    except Exception as e:
-        logger.warning(f"Failed to use TLS. {e}")
-        logger.warning("Try to use SSL.")
-        server = smtplib.SMTP_SSL(smtp_server, smtp_port)
-
-    server.login(sender, password)
-    server.sendmail(sender, [receiver], msg.as_string())
-    server.quit()
+    if session is not None:
+        session.send(receiver, msg)
+        return
+    with SMTPSession(sender, password, smtp_server, smtp_port) as new_session:
+        new_session.send(receiver, msg)
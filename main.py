@@ -1,10 +1,11 @@
 import argparse
 import os
 import sys
+import urllib.request
+import xml.etree.ElementTree as ET
 from tempfile import mkstemp
 
 import arxiv
-import feedparser
 from dotenv import load_dotenv
 from gitignore_parser import parse_gitignore
 from loguru import logger
@@ -13,7 +14,17 @@ from tqdm import tqdm
 
 from construct_email import render_email, send_email
 from paper import ArxivPaper
-from recommender import rank_papers
+from recommender import (
+    BACKENDS,
+    DEFAULT_CACHE_DIR,
+    SCORERS,
+    EmbeddingCache,
+    encode_corpus_and_candidates,
+    load_encoder,
+    rank_papers,
+    resolve_backend,
+    use_all_cores,
+)
 
 load_dotenv(override=True)
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
@@ -52,22 +63,47 @@ def filter_corpus(corpus: list[dict], pattern: str) -> list[dict]:
     return new_corpus
 
 
-def filter_corpus_by_tag(corpus: list[dict], tag: str) -> list[dict]:
-    """Filter corpus to only include papers with the specified tag."""
-    return [c for c in corpus if any(t["tag"] == tag for t in c["data"]["tags"])]
+def get_tag_indices(corpus: list[dict], tag: str) -> list[int]:
+    """Get the indices of the corpus papers with the specified tag."""
+    return [i for i, c in enumerate(corpus) if any(t["tag"] == tag for t in c["data"]["tags"])]
 
 
-def get_arxiv_papers(query: str, debug: bool = False) -> list[ArxivPaper]:
-    client = arxiv.Client(num_retries=10, delay_seconds=10)
-    feed = feedparser.parse(f"https://rss.arxiv.org/atom/{query}")
-    if "Feed error for query" in feed.feed.title:
+ATOM_NS = "{http://www.w3.org/2005/Atom}"
+ARXIV_NS = "{http://arxiv.org/schemas/atom}"
+
+
+def get_new_paper_ids(query: str) -> list[str]:
+    """Get the ids of the papers newly announced in the arXiv RSS feed of the query.
+
+    The feed is parsed incrementally and only the id and announce type of each entry are read.
+    """
+    request = urllib.request.Request(
+        f"https://rss.arxiv.org/atom/{query}", headers={"User-Agent": "zotero-arxiv-daily"}
+    )
+    ids = []
+    with urllib.request.urlopen(request) as response:
+        events = ET.iterparse(response, events=("start", "end"))
+        _, feed = next(events)
+        for event, elem in events:
+            if event == "end" and elem.tag == f"{ATOM_NS}entry":
+                if elem.findtext(f"{ARXIV_NS}announce_type") == "new":
+                    ids.append(elem.findtext(f"{ATOM_NS}id").removeprefix("oai:arXiv.org:"))
+                elem.clear()
+    if "Feed error for query" in feed.findtext(f"{ATOM_NS}title", ""):
         raise Exception(f"Invalid ARXIV_QUERY: {query}.")
+    return ids
+
+
+def get_arxiv_papers(query: str, debug: bool = False) -> list[ArxivPaper]:
+    all_paper_ids = get_new_paper_ids(query)
     if not debug:
+        # arXiv's API terms allow a single connection making one request every 3 seconds: batches are fetched
+        # sequentially through one client, which spaces its requests. A batch fills exactly one result page.
+        client = arxiv.Client(num_retries=10, delay_seconds=10)
         papers = []
-        all_paper_ids = [i.id.removeprefix("oai:arXiv.org:") for i in feed.entries if i.arxiv_announce_type == "new"]
         bar = tqdm(total=len(all_paper_ids), desc="Retrieving Arxiv papers")
-        for i in range(0, len(all_paper_ids), 50):
-            search = arxiv.Search(id_list=all_paper_ids[i : i + 50])
+        for i in range(0, len(all_paper_ids), client.page_size):
+            search = arxiv.Search(id_list=all_paper_ids[i : i + client.page_size])
             batch = [ArxivPaper(p) for p in client.results(search)]
             bar.update(len(batch))
             papers.extend(batch)
@@ -76,6 +112,9 @@ def get_arxiv_papers(query: str, debug: bool = False) -> list[ArxivPaper]:
     else:
         n_papers = 5
         logger.debug(f"Retrieve {n_papers} arxiv papers regardless of the date.")
+        # The API returns a full page (100 results by default) regardless of max_results, so ask for a page of
+        # exactly n_papers.
+        client = arxiv.Client(page_size=n_papers, num_retries=10, delay_seconds=10)
         search = arxiv.Search(
             query="cat:cs.AI OR cat:cs.CR OR cat:cs.LG", sort_by=arxiv.SortCriterion.SubmittedDate, max_results=n_papers
         )
@@ -106,6 +145,11 @@ def add_argument(*args, **kwargs):
             env_value = env_value.lower() in ["true", "1"]
         else:
             env_value = kwargs.get("type")(env_value)
+        # argparse does not check defaults against choices: reject invalid values before any download.
+        if "choices" in kwargs and env_value not in kwargs["choices"]:
+            parser.error(
+                f"invalid choice for {env_name}: {env_value!r} (choose from {', '.join(map(repr, kwargs['choices']))})"
+            )
         parser.set_defaults(**{arg_full_name: env_value})
 
 
@@ -129,6 +173,30 @@ if __name__ == "__main__":
         help="Minimum score of papers to recommend",
         default=-0.1,
     )
+    add_argument(
+        "--scorer",
+        type=str,
+        choices=SCORERS,
+        help="How candidates are scored against the Zotero corpus: one-class SVM decision function ('svm'), a faster "
+        "kernel-approximated SGD one-class SVM ('sgd_svm'), or mean cosine similarity in [-1, 1] ('cosine'). "
+        "min_score must be chosen for the selected scorer.",
+        default="svm",
+    )
+    add_argument(
+        "--max_corpus_size",
+        type=int,
+        help="With the 'svm' scorer, fit on a random sample of at most this many Zotero papers. Faster for large "
+        "libraries, but approximate.",
+        default=None,
+    )
+    add_argument(
+        "--backend",
+        type=str,
+        choices=BACKENDS,
+        help="Inference backend of the embedding model. 'onnx' is faster on CPU, 'onnx-int8' also quantizes the model "
+        "weights. Both need sentence-transformers[onnx].",
+        default="torch",
+    )
     add_argument("--arxiv_query", type=str, help="Arxiv search query")
     add_argument(
         "--zotero_tags",
@@ -136,6 +204,12 @@ if __name__ == "__main__":
         help="Comma-separated list of Zotero tags. Each tag will result in a separate list of papers. If not provided, the full Zotero corpus is considered.",
         default=None,
     )
+    add_argument(
+        "--cache_dir",
+        type=str,
+        help="Directory where the embeddings of the Zotero papers and the fitted scorers are cached between runs",
+        default=DEFAULT_CACHE_DIR,
+    )
     add_argument("--smtp_server", type=str, help="SMTP server")
     add_argument("--smtp_port", type=int, help="SMTP port")
     add_argument("--sender", type=str, help="Sender email address")
@@ -167,21 +241,43 @@ if __name__ == "__main__":
         corpus = filter_corpus(corpus, args.zotero_ignore)
         logger.info(f"Remaining {len(corpus)} papers after filtering.")
 
-    if args.zotero_tags:
-        tags = [tag.strip() for tag in args.zotero_tags.split(",")]
+    tags = [tag.strip() for tag in args.zotero_tags.split(",")] if args.zotero_tags else []
+    if tags:
         logger.info(f"Processing papers for tags: {tags}")
-
+        # Only papers carrying one of the tags are ranked against. Tags often overlap: each paper is encoded once
+        # and each tag picks the rows of its own papers.
+        tag_set = set(tags)
+        corpus = [c for c in corpus if any(t["tag"] in tag_set for t in c["data"]["tags"])]
+
+    logger.info("Encoding papers...")
+    use_all_cores()
+    encoder = load_encoder(backend=args.backend, cache_dir=args.cache_dir)
+    # Loading may fall back from onnx-int8 to onnx: cache the embeddings under the backend that computed them.
+    embedding_cache = EmbeddingCache(args.cache_dir, backend=resolve_backend(args.backend, cache_dir=args.cache_dir))
+    corpus_features, candidate_features = encode_corpus_and_candidates(encoder, corpus, papers, cache=embedding_cache)
+    embedding_cache.save()
+
+    if tags:
         tag_papers = {}
         tag_debug_info = {}
         for tag in tags:
             logger.info(f"Ranking papers for tag: {tag}")
-            tag_corpus = filter_corpus_by_tag(corpus, tag)
-            if not tag_corpus:
+            tag_indices = get_tag_indices(corpus, tag)
+            if not tag_indices:
                 logger.warning(f"No papers found in Zotero corpus with tag '{tag}'. Skipping.")
                 continue
-            logger.info(f"Found {len(tag_corpus)} papers with tag '{tag}' in Zotero corpus.")
-
-            ranked_papers, debug_info = rank_papers(papers.copy(), tag_corpus, min_score=args.min_score)
+            logger.info(f"Found {len(tag_indices)} papers with tag '{tag}' in Zotero corpus.")
+
+            scores, order, debug_info = rank_papers(
+                papers,
+                min_score=args.min_score,
+                scorer=args.scorer,
+                max_corpus_size=args.max_corpus_size,
+                scorer_cache_dir=args.cache_dir,
+                corpus_features=corpus_features[tag_indices],
+                candidate_features=candidate_features,
+            )
+            ranked_papers = list(zip((papers[i] for i in order), scores[order].tolist()))
 
             tag_debug_info[tag] = debug_info
             tag_papers[tag] = ranked_papers
@@ -201,11 +297,20 @@ if __name__ == "__main__":
         use_sections = True
     else:
         logger.info("Ranking papers against full corpus...")
-        papers, debug_info = rank_papers(papers, corpus, min_score=args.min_score)
-        if len(papers) == 0 and not args.send_empty:
+        scores, order, debug_info = rank_papers(
+            papers,
+            min_score=args.min_score,
+            scorer=args.scorer,
+            max_corpus_size=args.max_corpus_size,
+            scorer_cache_dir=args.cache_dir,
+            corpus_features=corpus_features,
+            candidate_features=candidate_features,
+        )
+        ranked_papers = list(zip((papers[i] for i in order), scores[order].tolist()))
+        if len(ranked_papers) == 0 and not args.send_empty:
             logger.info(f"No papers found above the threshold {args.min_score} (out of {n_papers_init} papers). Exit.")
             exit(0)
-        all_papers = {None: papers}
+        all_papers = {None: ranked_papers}
         debug_info = {None: debug_info}
         use_sections = False
 
@@ -1,55 +1,104 @@
+import posixpath
 import re
 import tarfile
 from contextlib import ExitStack
-from functools import cached_property
+from itertools import islice
 from tempfile import TemporaryDirectory
 
 import arxiv
 from loguru import logger
 
+_RE_VERSION = re.compile(r"v\d+$")
+_RE_COMMENT_LINE = re.compile(r"%.*\n")
+_RE_COMMENT_BLOCK = re.compile(r"\\begin\{comment\}.*?\\end\{comment\}", re.DOTALL)
+_RE_IFFALSE = re.compile(r"\\iffalse.*?\\fi", re.DOTALL)
+_RE_NEWLINES = re.compile(r"\n+")
+_RE_DOUBLE_BACKSLASH = re.compile(r"\\\\")
+_RE_SPACES = re.compile(r"[ \t\r\f]{3,}")
+_RE_DOCUMENT = re.compile(r"\\begin\{document\}")
+_RE_INPUT = re.compile(r"\\input\{(.+?)\}")
+_RE_INCLUDE = re.compile(r"\\include\{(.+?)\}")
+
+# Marks ArxivPaper.tex as not downloaded yet, since None is a valid result.
+_NOT_LOADED = object()
+
+
+def _clean_tex(content: str) -> str:
+    # remove comments
+    content = _RE_COMMENT_LINE.sub("\n", content)
+    content = _RE_COMMENT_BLOCK.sub("", content)
+    content = _RE_IFFALSE.sub("", content)
+    # remove redundant \n
+    content = _RE_NEWLINES.sub("\n", content)
+    content = _RE_DOUBLE_BACKSLASH.sub("", content)
+    # remove consecutive spaces
+    return _RE_SPACES.sub(" ", content)
+
 
 class ArxivPaper:
+    # Plain slot attributes instead of properties forwarding to the arxiv.Result: they are read for every paper in
+    # every section when ranking and rendering, and slots keep the hundreds of daily instances small.
+    __slots__ = ("_paper", "title", "summary", "authors", "pdf_url", "arxiv_id", "_authors_short", "_tex")
+
     def __init__(self, paper: arxiv.Result):
         self._paper = paper
-        self.score = None
-
-    @property
-    def title(self) -> str:
-        return self._paper.title
-
-    @property
-    def summary(self) -> str:
-        return self._paper.summary
+        self.title: str = paper.title
+        self.summary: str = paper.summary
+        self.authors: list[arxiv.Result.Author] = paper.authors
+        self.pdf_url: str = paper.pdf_url
+        self.arxiv_id: str = _RE_VERSION.sub("", paper.get_short_id())
+        self._authors_short: str | None = None
+        self._tex = _NOT_LOADED
 
     @property
-    def authors(self) -> list[str]:
-        return self._paper.authors
-
-    @cached_property
-    def arxiv_id(self) -> str:
-        return re.sub(r"v\d+$", "", self._paper.get_short_id())
+    def authors_short(self) -> str:
+        if self._authors_short is None:
+            authors = ", ".join(a.name for a in islice(self.authors, 5))
+            if len(self.authors) > 5:
+                authors += ", ..."
+            self._authors_short = authors
+        return self._authors_short
 
     @property
-    def pdf_url(self) -> str:
-        return self._paper.pdf_url
+    def tex(self) -> dict[str, str] | None:
+        if self._tex is _NOT_LOADED:
+            self._tex = self._load_tex()
+        return self._tex
 
-    @cached_property
-    def tex(self) -> dict[str, str]:
+    def _load_tex(self) -> dict[str, str] | None:
         with ExitStack() as stack:
             tmpdirname = stack.enter_context(TemporaryDirectory())
             file = self._paper.download_source(dirpath=tmpdirname)
             try:
-                tar = stack.enter_context(tarfile.open(file))
+                # Stream the archive: all needed members are read in a single forward pass.
+                tar = stack.enter_context(tarfile.open(file, mode="r|*"))
             except tarfile.ReadError:
                 logger.debug(f"Failed to find main tex file of {self.arxiv_id}: Not a tar file.")
                 return None
 
-            tex_files = [f for f in tar.getnames() if f.endswith(".tex")]
+            tex_files = {}
+            tex_links = {}
+            bbl_file = []
+            for member in tar:
+                if member.name.endswith(".tex"):
+                    if member.isfile():
+                        tex_files[member.name] = tar.extractfile(member).read()
+                    elif member.issym():
+                        tex_links[member.name] = posixpath.normpath(
+                            posixpath.join(posixpath.dirname(member.name), member.linkname)
+                        )
+                    elif member.islnk():
+                        tex_links[member.name] = member.linkname
+                elif member.name.endswith(".bbl"):
+                    bbl_file.append(member.name)
+            # A streamed archive cannot extract links: resolve them to the files read in the same pass.
+            for name, target in tex_links.items():
+                if target in tex_files:
+                    tex_files[name] = tex_files[target]
             if len(tex_files) == 0:
                 logger.debug(f"Failed to find main tex file of {self.arxiv_id}: No tex file.")
                 return None
 
-            bbl_file = [f for f in tar.getnames() if f.endswith(".bbl")]
             match len(bbl_file):
                 case 0:
                     if len(tex_files) > 1:
@@ -58,7 +107,7 @@ class ArxivPaper:
                         )
                         main_tex = None
                     else:
-                        main_tex = tex_files[0]
+                        main_tex = next(iter(tex_files))
                 case 1:
                     main_name = bbl_file[0].replace(".bbl", "")
                     main_tex = f"{main_name}.tex"
@@ -78,19 +127,10 @@ class ArxivPaper:
                 )
             # read all tex files
             file_contents = {}
-            for t in tex_files:
-                f = tar.extractfile(t)
-                content = f.read().decode("utf-8", errors="ignore")
-                # remove comments
-                content = re.sub(r"%.*\n", "\n", content)
-                content = re.sub(r"\\begin{comment}.*?\\end{comment}", "", content, flags=re.DOTALL)
-                content = re.sub(r"\\iffalse.*?\\fi", "", content, flags=re.DOTALL)
-                # remove redundant \n
-                content = re.sub(r"\n+", "\n", content)
-                content = re.sub(r"\\\\", "", content)
-                # remove consecutive spaces
-                content = re.sub(r"[ \t\r\f]{3,}", " ", content)
-                if main_tex is None and re.search(r"\\begin\{document\}", content):
+            for t, raw in tex_files.items():
+                content = raw.decode("utf-8", errors="ignore")
+                content = _clean_tex(content)
+                if main_tex is None and _RE_DOCUMENT.search(content):
                     main_tex = t
                     logger.debug(f"Choose {t} as main tex file of {self.arxiv_id}")
                 file_contents[t] = content
@@ -98,9 +138,7 @@ class ArxivPaper:
             if main_tex is not None:
                 main_source: str = file_contents[main_tex]
                 # find and replace all included sub-files
-                include_files = re.findall(r"\\input\{(.+?)\}", main_source) + re.findall(
-                    r"\\include\{(.+?)\}", main_source
-                )
+                include_files = _RE_INPUT.findall(main_source) + _RE_INCLUDE.findall(main_source)
                 for f in include_files:
                     if not f.endswith(".tex"):
                         file_name = f + ".tex"
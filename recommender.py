@@ -1,37 +1,375 @@
-from sentence_transformers import SentenceTransformer
-from sklearn.preprocessing import StandardScaler
+import hashlib
+import os
+import platform
+import time
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from tempfile import NamedTemporaryFile
+from typing import IO
+
+import joblib
+import numpy as np
+import sklearn
+import torch
+from loguru import logger
+from sentence_transformers import SentenceTransformer, export_dynamic_quantized_onnx_model
+from sklearn.base import BaseEstimator
+from sklearn.kernel_approximation import Nystroem
+from sklearn.linear_model import SGDOneClassSVM
+from sklearn.pipeline import make_pipeline
 from sklearn.svm import OneClassSVM
+from threadpoolctl import threadpool_limits
 
 from paper import ArxivPaper
 
+DEFAULT_MODEL = "avsolatorio/GIST-small-Embedding-v0"
+SCORERS = ("svm", "sgd_svm", "cosine")
+BACKENDS = ("torch", "onnx", "onnx-int8")
+DEFAULT_CACHE_DIR = "~/.cache/zotero-arxiv-daily"
+# Large enough for the encoder to length-sort texts into well-filled batches.
+ENCODE_CHUNK_SIZE = 2048
+# Candidates are scored against the support vectors by chunks of this many rows.
+SCORE_CHUNK_SIZE = 1024
+# Fitted scorers that have not been used for this long are removed from the cache.
+_FIT_CACHE_MAX_AGE = 7 * 24 * 3600
+
+# Sample used to check that the quantized encoder stays close to the fp32 one.
+_QUANTIZATION_CHECK_TEXTS = [
+    "We propose a new method for training large language models with reinforcement learning from human feedback.",
+    "A one-class support vector machine estimates the support of a high-dimensional distribution.",
+    "We study the adversarial robustness of image classifiers under small perturbations of the input.",
+    "This paper introduces a benchmark for evaluating the reasoning abilities of neural networks.",
+]
+# Written next to the exported model when the quantized embeddings failed the check, so it is not re-exported.
+_INT8_REJECTED_FILE_NAME = "int8_rejected_{config}"
+
+
+def _available_cores() -> int:
+    return len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+
+
+def use_all_cores():
+    """Run torch and the BLAS libraries of numpy / sklearn on every core available to the process."""
+    n_threads = _available_cores()
+    torch.set_num_threads(n_threads)
+    # Encoding is a single stream of operators, inter-op parallelism only adds thread contention.
+    # torch only allows setting this once, and not after any inter-op work started.
+    if torch.get_num_interop_threads() != 1:
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError as e:
+            logger.debug(f"Could not limit torch inter-op threads: {e}")
+    threadpool_limits(n_threads)
+
+
+@lru_cache(maxsize=1)
+def _quantization_config() -> str:
+    """The ONNX Runtime quantization config matching the instruction sets of this CPU."""
+    if platform.machine().lower() in ("arm64", "aarch64"):
+        return "arm64"
+    try:
+        flags = set(Path("/proc/cpuinfo").read_text().split())
+    except OSError:
+        flags = set()
+    if "avx512_vnni" in flags:
+        return "avx512_vnni"
+    if "avx512f" in flags:
+        return "avx512"
+    return "avx2"
+
+
+def _int8_file_name() -> str:
+    return f"onnx/model_qint8_{_quantization_config()}.onnx"
+
+
+def _int8_rejected_path(model: str, cache_dir: str) -> Path:
+    return _int8_model_dir(model, cache_dir) / _INT8_REJECTED_FILE_NAME.format(config=_quantization_config())
+
+
+def _int8_model_dir(model: str, cache_dir: str) -> Path:
+    return Path(cache_dir).expanduser() / "models" / model.replace("/", "--")
+
+
+def resolve_backend(backend: str, model: str = DEFAULT_MODEL, cache_dir: str = DEFAULT_CACHE_DIR) -> str:
+    """The backend `load_encoder` actually runs: "onnx" for "onnx-int8" once the quantized model was rejected."""
+    if backend == "onnx-int8" and _int8_rejected_path(model, cache_dir).exists():
+        return "onnx"
+    return backend
+
+
+def _load_int8_encoder(model: str, cache_dir: str) -> SentenceTransformer:
+    """Load the INT8 quantized ONNX encoder, exporting it on first use and falling back to fp32 if it is too lossy."""
+    model_dir = _int8_model_dir(model, cache_dir)
+    config = _quantization_config()
+    file_name = _int8_file_name()
+    if resolve_backend("onnx-int8", model, cache_dir) == "onnx":
+        return SentenceTransformer(str(model_dir), backend="onnx")
+    if (model_dir / file_name).exists():
+        return SentenceTransformer(str(model_dir), backend="onnx", model_kwargs={"file_name": file_name})
+
+    logger.info(f"Exporting an INT8 quantized ONNX model ({config}) to {model_dir}...")
+    fp32_encoder = SentenceTransformer(model, backend="onnx")
+    fp32_encoder.save(str(model_dir))
+    export_dynamic_quantized_onnx_model(fp32_encoder, config, str(model_dir))
+    encoder = SentenceTransformer(str(model_dir), backend="onnx", model_kwargs={"file_name": file_name})
+
+    similarity = (
+        encode_texts(encoder, _QUANTIZATION_CHECK_TEXTS) * encode_texts(fp32_encoder, _QUANTIZATION_CHECK_TEXTS)
+    ).sum(axis=1)
+    if similarity.min() < 0.99:
+        logger.warning(
+            f"INT8 embeddings are too far from the fp32 ones (cosine similarity {similarity.min():.3f}), "
+            f"using the fp32 ONNX model. Delete {model_dir} to retry the quantization."
+        )
+        (model_dir / file_name).unlink()
+        _int8_rejected_path(model, cache_dir).write_text(f"min cosine similarity {similarity.min():.4f}\n")
+        return fp32_encoder
+    return encoder
+
+
+@lru_cache(maxsize=4)
+def load_encoder(
+    model: str = DEFAULT_MODEL, backend: str = "torch", cache_dir: str = DEFAULT_CACHE_DIR
+) -> SentenceTransformer:
+    """Load the sentence-transformers model, once per model name, backend and process."""
+    if backend == "onnx-int8":
+        return _load_int8_encoder(model, cache_dir)
+    encoder = SentenceTransformer(model, backend=backend)
+    if backend == "torch" and encoder.device.type == "cuda":
+        # Half precision runs the matmuls on tensor cores; CPUs have no fast fp16 path, so they stay in fp32.
+        encoder.half()
+    return encoder
+
+
+def encode_texts(encoder: SentenceTransformer, texts: list[str]) -> np.ndarray:
+    """Encode texts into L2-normalized float32 embeddings, chunk by chunk into a preallocated array."""
+    features = np.empty((len(texts), encoder.get_sentence_embedding_dimension()), dtype=np.float32)
+    for start in range(0, len(texts), ENCODE_CHUNK_SIZE):
+        features[start : start + ENCODE_CHUNK_SIZE] = encoder.encode(
+            texts[start : start + ENCODE_CHUNK_SIZE],
+            batch_size=128,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+            normalize_embeddings=True,
+        )
+    return features
+
+
+def _atomic_write(path: Path, writer: Callable[[IO[bytes]], None]):
+    """Write a file through `writer`, so that an interrupted run cannot leave a truncated file behind."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with NamedTemporaryFile(dir=path.parent, suffix=".tmp", delete=False) as f:
+        writer(f)
+    os.replace(f.name, path)
+
+
+class EmbeddingCache:
+    """On-disk cache of the embeddings computed by one model, keyed by a hash of the text."""
+
+    def __init__(self, cache_dir: str, model: str = DEFAULT_MODEL, backend: str = "torch"):
+        name = model.replace("/", "--") if backend == "torch" else f"{model.replace('/', '--')}-{backend}"
+        self.path = Path(cache_dir).expanduser() / f"embeddings-{name}.npz"
+        self._features: dict[str, np.ndarray] = {}
+        self._used: set[str] = set()
+        if self.path.exists():
+            with np.load(self.path) as data:
+                self._features = dict(zip(data["keys"].tolist(), data["features"]))
+
+    @staticmethod
+    def _key(text: str) -> str:
+        return hashlib.blake2b(text.encode(), digest_size=16).hexdigest()
+
+    def encode(self, encoder: SentenceTransformer, texts: list[str]) -> np.ndarray:
+        """Same as `encode_texts`, but only the texts missing from the cache are encoded (in a single call)."""
+        keys = [self._key(t) for t in texts]
+        missing = {k: t for k, t in zip(keys, texts) if k not in self._features}
+        if missing:
+            self._features.update(zip(missing, encode_texts(encoder, list(missing.values()))))
+        self._used.update(keys)
+        features = np.empty((len(keys), encoder.get_sentence_embedding_dimension()), dtype=np.float32)
+        for i, k in enumerate(keys):
+            features[i] = self._features[k]
+        return features
+
+    def save(self):
+        keys = [k for k in self._features if k in self._used]
+        if not keys:
+            return
+        features = np.stack([self._features[k] for k in keys])
+        _atomic_write(self.path, lambda f: np.savez(f, keys=np.array(keys), features=features))
+
+
+def encode_corpus_and_candidates(
+    encoder: SentenceTransformer,
+    corpus: list[dict],
+    candidates: list[ArxivPaper],
+    cache: EmbeddingCache | None = None,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Encode the corpus abstracts and the candidate summaries, returning (corpus_features, candidate_features)."""
+    # A single encode call lets sentence-transformers length-sort corpus and candidates together,
+    # which keeps batches full and padding low.
+    texts = [paper["data"]["abstractNote"] for paper in corpus] + [paper.summary for paper in candidates]
+    features = encode_texts(encoder, texts) if cache is None else cache.encode(encoder, texts)
+    return features[: len(corpus)], features[len(corpus) :]
+
+
+def _rbf_kernel(X: np.ndarray, Y: np.ndarray, gamma: float) -> np.ndarray:
+    """RBF kernel between the rows of X and Y, in fp16 on GPU and in place on CPU."""
+    if not torch.cuda.is_available():
+        kernel = X @ Y.T
+        kernel *= -2
+        kernel += np.einsum("ij,ij->i", X, X)[:, None]
+        kernel += np.einsum("ij,ij->i", Y, Y)
+        np.maximum(kernel, 0, out=kernel)
+        kernel *= -gamma
+        return np.exp(kernel, out=kernel)
+    x = torch.as_tensor(X, device="cuda")
+    y = torch.as_tensor(Y, device="cuda")
+    dot = (x.half() @ y.half().T).float()
+    sq_dists = x.float().square().sum(dim=1, keepdim=True) + y.float().square().sum(dim=1) - 2 * dot
+    return torch.exp(-gamma * sq_dists.clamp_(min=0)).cpu().numpy()
+
+
+def _kernel_scores(X: np.ndarray, support_vectors: np.ndarray, dual_coef: np.ndarray, gamma: float) -> np.ndarray:
+    """`_rbf_kernel(X, support_vectors, gamma) @ dual_coef`, with the rows of X split in chunks scored in parallel."""
+    chunks = [X[start : start + SCORE_CHUNK_SIZE] for start in range(0, len(X), SCORE_CHUNK_SIZE)]
+    n_workers = min(len(chunks), _available_cores())
+    if n_workers <= 1 or torch.cuda.is_available():
+        return _rbf_kernel(X, support_vectors, gamma) @ dual_coef
+    with threadpool_limits(1), ThreadPoolExecutor(max_workers=n_workers) as executor:
+        scores = executor.map(lambda chunk: _rbf_kernel(chunk, support_vectors, gamma) @ dual_coef, chunks)
+        return np.concatenate(list(scores))
+
+
+def _fit_cached(estimator: BaseEstimator, features: np.ndarray, cache_dir: str | None) -> BaseEstimator:
+    """Fit the estimator on the features, or load it from `cache_dir` if it was already fitted on the same data."""
+    if cache_dir is None:
+        return estimator.fit(features)
+    key = hashlib.blake2b(digest_size=16)
+    key.update(
+        f"{sklearn.__version__} {sorted(estimator.get_params().items())} {features.shape} {features.dtype}".encode()
+    )
+    key.update(np.ascontiguousarray(features).data)
+    path = Path(cache_dir).expanduser() / "scorers" / f"{key.hexdigest()}.joblib"
+    if path.exists():
+        try:
+            fitted = joblib.load(path)
+        except Exception as e:
+            logger.warning(f"Failed to load the cached scorer {path}, refitting. {e}")
+            path.unlink(missing_ok=True)
+        else:
+            path.touch()
+            return fitted
+
+    estimator.fit(features)
+    _atomic_write(path, lambda f: joblib.dump(estimator, f))
+    # Also removes the temporary files of runs killed while writing.
+    for old in path.parent.iterdir():
+        if time.time() - old.stat().st_mtime > _FIT_CACHE_MAX_AGE:
+            old.unlink()
+    return estimator
+
+
+def _svm_scores(
+    corpus_features: np.ndarray,
+    candidate_features: np.ndarray,
+    nu: float,
+    gamma: str,
+    max_corpus_size: int | None = None,
+    cache_dir: str | None = None,
+) -> np.ndarray:
+    n_corpus = len(corpus_features)
+    if max_corpus_size is not None and n_corpus > max_corpus_size:
+        # Fitting is quadratic to cubic in the corpus size: fit on a uniform sample, which has the same density.
+        sample = np.random.default_rng(0).choice(n_corpus, max_corpus_size, replace=False)
+        corpus_features = corpus_features[np.sort(sample)]
+    ocsvm = _fit_cached(OneClassSVM(nu=nu, kernel="rbf", gamma=gamma), corpus_features, cache_dir)
+    # Same as ocsvm.decision_function, but the kernel against the support vectors is computed with a BLAS matrix
+    # product instead of LIBSVM's per-support-vector loop. LIBSVM stores the model in float64; it is scored in
+    # float32 like the embeddings, which halves the memory traffic of the kernel matrix.
+    scores = _kernel_scores(
+        candidate_features,
+        ocsvm.support_vectors_.astype(np.float32),
+        ocsvm.dual_coef_.ravel().astype(np.float32),
+        np.float32(ocsvm._gamma),
+    )
+    scores += np.float32(ocsvm.intercept_[0])
+    # The dual coefficients sum to nu * n_samples, so rescale the scores of a sample to the range of the full corpus.
+    return scores * (n_corpus / len(corpus_features))
+
+
+def _sgd_svm_scores(
+    corpus_features: np.ndarray,
+    candidate_features: np.ndarray,
+    nu: float,
+    gamma: str,
+    cache_dir: str | None = None,
+) -> np.ndarray:
+    """One-class SVM on a Nystroem approximation of the RBF kernel, trained with SGD."""
+    if gamma == "scale":
+        gamma = 1 / (corpus_features.shape[1] * corpus_features.var())
+    model = make_pipeline(
+        Nystroem(gamma=gamma, n_components=min(300, len(corpus_features)), random_state=0),
+        SGDOneClassSVM(nu=nu, random_state=0),
+    )
+    model = _fit_cached(model, corpus_features, cache_dir)
+    return model.decision_function(candidate_features)
+
+
+def _cosine_scores(corpus_features: np.ndarray, candidate_features: np.ndarray) -> np.ndarray:
+    """Mean cosine similarity of each candidate to the corpus, computed with a single matrix product."""
+    # The embeddings are L2-normalized, so dot products are cosine similarities.
+    return (candidate_features @ corpus_features.T).mean(axis=1)
+
+
+def _filter_sort(scores: np.ndarray, min_score: float) -> np.ndarray:
+    """Indices of the scores at least `min_score`, sorted by decreasing score (ties keep their order)."""
+    # Filter before sorting: only the candidates above the threshold are sorted, usually a small fraction.
+    keep = np.flatnonzero(scores >= min_score)
+    return keep[np.argsort(-scores[keep], kind="stable")]
+
 
 def rank_papers(
     candidates: list[ArxivPaper],
-    corpus: list[dict],
-    model: str = "avsolatorio/GIST-small-Embedding-v0",
+    corpus: list[dict] | None = None,
+    model: str = DEFAULT_MODEL,
     nu: float = 0.1,
     gamma: str = "scale",
     min_score: float = -0.1,
-) -> tuple[list[ArxivPaper], dict]:
-    encoder = SentenceTransformer(model)
-    corpus_features = encoder.encode([paper["data"]["abstractNote"] for paper in corpus])
-    candidate_features = encoder.encode([paper.summary for paper in candidates])
-
-    scaler = StandardScaler()
-    corpus_features_scaled = scaler.fit_transform(corpus_features)
-    candidate_features_scaled = scaler.transform(candidate_features)
+    scorer: str = "svm",
+    *,
+    max_corpus_size: int | None = None,
+    scorer_cache_dir: str | None = None,
+    encoder: SentenceTransformer | None = None,
+    corpus_features: np.ndarray | None = None,
+    candidate_features: np.ndarray | None = None,
+) -> tuple[np.ndarray, np.ndarray, dict]:
+    """Score candidates against the corpus, returning (scores, indices kept sorted by decreasing score, debug info)."""
+    if scorer not in SCORERS:
+        raise ValueError(f"Invalid scorer: {scorer}. Expected one of {SCORERS}.")
+    if corpus is None and corpus_features is None:
+        raise ValueError("Either corpus or corpus_features must be given.")
+    if encoder is None and (corpus_features is None or candidate_features is None):
+        encoder = load_encoder(model)
+    if corpus_features is None and candidate_features is None:
+        corpus_features, candidate_features = encode_corpus_and_candidates(encoder, corpus, candidates)
+    if corpus_features is None:
+        corpus_features = encode_texts(encoder, [paper["data"]["abstractNote"] for paper in corpus])
+    if candidate_features is None:
+        candidate_features = encode_texts(encoder, [paper.summary for paper in candidates])
 
-    ocsvm = OneClassSVM(nu=nu, kernel="rbf", gamma=gamma)
-    ocsvm.fit(corpus_features_scaled)
-    scores = ocsvm.decision_function(candidate_features_scaled)
+    if scorer == "svm":
+        scores = _svm_scores(corpus_features, candidate_features, nu, gamma, max_corpus_size, scorer_cache_dir)
+    elif scorer == "sgd_svm":
+        scores = _sgd_svm_scores(corpus_features, candidate_features, nu, gamma, scorer_cache_dir)
+    else:
+        scores = _cosine_scores(corpus_features, candidate_features)
 
     debug_info = {
-        "max_score": max(scores).item(),
-        "min_score": min(scores).item(),
+        "max_score": scores.max().item(),
+        "min_score": scores.min().item(),
     }
 
-    for score, candidate in zip(scores, candidates):
-        candidate.score = score.item()
-    matching_papers = [c for c in candidates if c.score >= min_score]
-    matching_papers = sorted(matching_papers, key=lambda x: x.score, reverse=True)
-    return matching_papers, debug_info
+    return scores, _filter_sort(scores, min_score), debug_info
@@ -0,0 +1,11 @@
+from paper import _clean_tex
+
+
+def test_clean_tex_keeps_text_between_dropped_blocks():
+    assert _clean_tex("A\\iffalse x\\fi BODY TEXT\\iffalse y\\fi\t\t\tZ") == "A BODY TEXT Z"
+    assert _clean_tex("A\\begin{comment}x\\end{comment} B \\begin{comment}y\\end{comment}   C") == "A B C"
+
+
+def test_clean_tex_drops_comments_and_collapses_whitespace():
+    source = "\\iffalse note\\fi\n% comment\n\n\\begin{document}\nHello\\\\   world\n\n\n\\end{document}\n"
+    assert _clean_tex(source) == "\n\\begin{document}\nHello world\n\\end{document}\n"
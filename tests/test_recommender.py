@@ -0,0 +1,25 @@
+import numpy as np
+import pytest
+from sklearn.svm import OneClassSVM
+
+import recommender
+
+
+def _normalized(rng: np.random.Generator, n: int, d: int = 64) -> np.ndarray:
+    x = rng.normal(size=(n, d)).astype(np.float32)
+    return x / np.linalg.norm(x, axis=1, keepdims=True)
+
+
+@pytest.mark.parametrize("n_candidates", [200, 2 * recommender.SCORE_CHUNK_SIZE + 10])
+def test_svm_scores_match_decision_function(monkeypatch, n_candidates):
+    # Force the threaded path for several chunks even on single-core machines.
+    monkeypatch.setattr(recommender, "_available_cores", lambda: 4)
+    rng = np.random.default_rng(0)
+    corpus = _normalized(rng, 500)
+    candidates = _normalized(rng, n_candidates)
+
+    expected = OneClassSVM(nu=0.1, kernel="rbf", gamma="scale").fit(corpus).decision_function(candidates)
+    scores = recommender._svm_scores(corpus, candidates, nu=0.1, gamma="scale")
+
+    assert scores.shape == expected.shape
+    np.testing.assert_allclose(scores, expected, rtol=0, atol=1e-4)